@@ -3,8 +3,10 @@ from __future__ import annotations
 """应用配置。
 
 当前仅包含媒体根目录，用于服务器端浏览/选择视频文件。
+可通过环境变量 QUICLIP_MEDIA_ROOT 覆盖默认值。
 """
 
+import os
 from dataclasses import dataclass
 
 MEDIA_ROOT = "/vol3/1003/Adult"
@@ -21,5 +23,6 @@ class AppConfig:
 
     @staticmethod
     def from_env() -> "AppConfig":
-        """从环境/常量加载配置。"""
-        return AppConfig(media_root=MEDIA_ROOT)
+        """从环境/常量加载配置（环境变量优先）。"""
+        media_root = os.environ.get("QUICLIP_MEDIA_ROOT", "").strip() or MEDIA_ROOT
+        return AppConfig(media_root=media_root)
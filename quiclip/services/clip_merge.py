@@ -5,9 +5,18 @@ from __future__ import annotations
 import os
 import tempfile
 import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 
-from quiclip.services.ffmpeg_utils import fast_concat_mp4, fast_trim_to_mp4
+from quiclip.services.ffmpeg_utils import (
+    FfmpegError,
+    fast_concat_mp4,
+    fast_concat_slices_mp4,
+    fast_trim_to_mp4,
+    max_parallel_encodes,
+    probe_stream_signature,
+    probe_video_format,
+)
 
 
 @dataclass(frozen=True)
@@ -19,27 +28,105 @@ class ClipSegment:
     end_sec: float
 
 
-def clip_and_merge(segments: list[ClipSegment], output_dir: str) -> str:
-    """对多个区间进行无重编码裁剪后 concat 合并，返回输出文件路径。"""
+def _trim_parallelism(segment_count: int, encoding: bool) -> int:
+    """裁剪并发数：默认按 CPU 核数，可通过 QUICLIP_TRIM_PARALLELISM 覆盖。
+
+    需要重编码且选用了硬件编码器时，再受硬件同时会话数的限制。
+    """
+
+    default = os.cpu_count() or 4
+    raw = os.environ.get("QUICLIP_TRIM_PARALLELISM", "").strip()
+    try:
+        workers = int(raw) if raw else default
+    except ValueError:
+        workers = default
+    if encoding:
+        limit = max_parallel_encodes()
+        if limit is not None:
+            workers = min(workers, limit)
+    return max(1, min(segment_count, workers))
+
+
+def _reserve_output_path(output_dir: str, prefix: str) -> str:
+    """以 O_EXCL 创建空的输出文件并返回其路径，同一秒内的并发任务不会写到同一个文件。"""
+
+    os.makedirs(output_dir, exist_ok=True)
+    ts = time.strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(output_dir, f"{prefix}-{ts}.mp4")
+    n = 0
+    while True:
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            n += 1
+            path = os.path.join(output_dir, f"{prefix}-{ts}-{n}.mp4")
+            continue
+        os.close(fd)
+        return path
+
+
+def _discard(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _same_stream_layout(paths: list[str]) -> bool:
+    """多个源文件的流参数是否一致（一致才能不重编码直接拼接）。"""
+
+    if len(paths) <= 1:
+        return True
+    try:
+        first = probe_stream_signature(paths[0])
+        return all(probe_stream_signature(p) == first for p in paths[1:])
+    except FfmpegError:
+        return False
+
+
+def clip_and_merge(segments: list[ClipSegment], output_dir: str, reencode: bool = False) -> str:
+    """对多个区间进行裁剪后 concat 合并，返回输出文件路径。
+
+    - 默认无重编码：一次 ffmpeg 按 inpoint/outpoint 直接拼接各区间
+    - 多个源文件流参数不一致、或 reencode=True 时：并发重编码裁剪后再合并
+    """
 
     if not segments:
         raise ValueError("区间列表为空")
 
-    os.makedirs(output_dir, exist_ok=True)
+    output_path = _reserve_output_path(output_dir, "quiclip-clip")
+    try:
+        _clip_and_merge_to(segments, output_path, reencode)
+    except BaseException:
+        # 失败时删掉预占的输出文件，不留下空文件
+        _discard(output_path)
+        raise
+    return output_path
 
-    ts = time.strftime("%Y%m%d-%H%M%S")
-    output_path = os.path.join(output_dir, f"quiclip-clip-{ts}.mp4")
+
+def _clip_and_merge_to(segments: list[ClipSegment], output_path: str, reencode: bool) -> None:
+    # 流参数一致（含同一源文件）的无重编码剪辑：一次 ffmpeg 直接按 inpoint/outpoint 拼接，不落地临时片段
+    input_paths = list(dict.fromkeys(seg.input_path for seg in segments))
+    if not reencode and _same_stream_layout(input_paths):
+        fast_concat_slices_mp4([(seg.input_path, seg.start_sec, seg.end_sec) for seg in segments], output_path)
+        return
 
     with tempfile.TemporaryDirectory(prefix="quiclip_") as tmp:
-        part_paths: list[str] = []
-        for idx, seg in enumerate(segments, start=1):
-            part_path = os.path.join(tmp, f"part_{idx:03d}.mp4")
-            fast_trim_to_mp4(seg.input_path, seg.start_sec, seg.end_sec, part_path)
-            part_paths.append(part_path)
+        # 先确定各片段路径，保证并发裁剪后 concat 顺序不变
+        part_paths = [os.path.join(tmp, f"part_{idx:03d}.mp4") for idx in range(1, len(segments) + 1)]
 
-        fast_concat_mp4(part_paths, output_path)
+        # 走到这里说明需要重编码：各片段统一到第一个源文件的分辨率与帧率，
+        # 音频统一为 48kHz 双声道，编码参数一致后才能 -c copy 合并
+        target = probe_video_format(segments[0].input_path)
 
-    return output_path
+        def _trim(part_path: str, seg: ClipSegment) -> None:
+            fast_trim_to_mp4(seg.input_path, seg.start_sec, seg.end_sec, part_path, reencode=True, target=target)
+
+        # 每个片段是独立的 ffmpeg 进程，线程等待子进程时不占用 GIL
+        with ThreadPoolExecutor(max_workers=_trim_parallelism(len(segments), encoding=True)) as ex:
+            list(ex.map(_trim, part_paths, segments))
+
+        fast_concat_mp4(part_paths, output_path)
 
 
 def merge_videos(video_paths: list[str], output_dir: str) -> str:
@@ -48,9 +135,10 @@ def merge_videos(video_paths: list[str], output_dir: str) -> str:
     if not video_paths:
         raise ValueError("视频列表为空")
 
-    os.makedirs(output_dir, exist_ok=True)
-
-    ts = time.strftime("%Y%m%d-%H%M%S")
-    output_path = os.path.join(output_dir, f"quiclip-merge-{ts}.mp4")
-    fast_concat_mp4(video_paths, output_path)
+    output_path = _reserve_output_path(output_dir, "quiclip-merge")
+    try:
+        fast_concat_mp4(video_paths, output_path)
+    except BaseException:
+        _discard(output_path)
+        raise
     return output_path
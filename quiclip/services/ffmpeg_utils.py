@@ -2,12 +2,15 @@ from __future__ import annotations
 
 """ffmpeg/ffprobe 相关工具封装。
 
-仅提供本项目所需的最小能力：读取时长、裁剪、合并。
+仅提供本项目所需的最小能力：读取时长、裁剪、合并、预览片段。
 """
 
-import json
+import functools
 import os
+import shutil
 import subprocess
+import threading
+from collections import deque
 from dataclasses import dataclass
 
 
@@ -22,56 +25,362 @@ class VideoMeta:
     duration_seconds: float
 
 
-def _run(cmd: list[str]) -> subprocess.CompletedProcess:
-    """运行子进程并返回结果（不抛异常，由调用方检查 returncode）。"""
-    return subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+@dataclass(frozen=True)
+class VideoFormat:
+    """首路视频流的画面参数，用于重编码时统一各片段。"""
+
+    width: int
+    height: int
+    # ffprobe 的 avg_frame_rate 原样保留（如 30000/1001），可直接传给 fps 滤镜
+    frame_rate: str
+
+
+@dataclass(frozen=True)
+class _RunResult:
+    """子进程结果：返回码与 stderr 末尾若干行。"""
+
+    returncode: int
+    stderr: str
+
+
+# _run 保留的 stderr 行数（足够定位 ffmpeg 报错）
+_STDERR_TAIL_LINES = 200
+
+# 流参数直接来自 moov 索引的容器，可以放心缩小输入探测量
+_FAST_PROBE_EXTS = {".mp4", ".mov", ".m4v"}
+
+# 按顺序尝试的硬件 H.264 编码器，都不可用时使用 libx264
+_HW_H264_ENCODERS = ("h264_nvenc", "h264_qsv", "h264_videotoolbox")
+
+# 硬件编码器同时打开的会话数有限（消费级 NVENC 通常 3~8 路），默认只并发 2 路
+_HW_ENCODE_PARALLELISM_DEFAULT = 2
+
+
+def _run(cmd: list[str], input: str | None = None) -> _RunResult:
+    """运行子进程并返回结果（不抛异常，由调用方检查 returncode）。
+
+    stdout 丢弃，stderr 边读边丢、只保留末尾若干行：长时间编码的日志不会无限占用内存。
+    """
+
+    tail: deque[str] = deque(maxlen=_STDERR_TAIL_LINES)
+    # with 负责关闭管道并等待子进程，读取 stderr 出错时也不会遗留僵尸进程
+    with subprocess.Popen(
+        cmd,
+        stdin=subprocess.PIPE if input is not None else None,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        encoding="utf-8",
+        errors="replace",
+    ) as proc:
+        feeder = None
+        if input is not None:
+            # 另起线程写 stdin，避免与下面读取 stderr 互相阻塞
+            feeder = threading.Thread(target=_feed_stdin, args=(proc.stdin, input), daemon=True)
+            feeder.start()
+
+        for line in proc.stderr:
+            tail.append(line)
+        returncode = proc.wait()
+        if feeder is not None:
+            # 子进程已退出，写入线程很快结束；等它自己关闭 stdin，避免与 __exit__ 同时关闭
+            feeder.join()
+    return _RunResult(returncode=returncode, stderr="".join(tail))
+
+
+def _feed_stdin(stdin, data: str) -> None:
+    try:
+        stdin.write(data)
+    except OSError:
+        pass
+    finally:
+        try:
+            stdin.close()
+        except OSError:
+            pass
+
+
+def _capture(cmd: list[str]) -> subprocess.CompletedProcess:
+    """运行输出有限的命令（ffprobe、-encoders 等）并完整捕获 stdout/stderr。"""
+    return subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, errors="replace")
+
+
+_ffmpeg_checked = False
+_ffmpeg_exes: dict[str, str] = {}
 
 
 def ensure_ffmpeg_available() -> None:
-    """检查 ffmpeg/ffprobe 是否可用。"""
+    """检查 ffmpeg/ffprobe 是否可用（每个进程只实际检查一次）。
+
+    同时记录两者在 PATH 中的绝对路径，后续启动子进程时不必再逐个目录查找。
+    """
+
+    global _ffmpeg_checked
+    if _ffmpeg_checked:
+        return
 
+    resolved: dict[str, str] = {}
     for exe in ("ffmpeg", "ffprobe"):
-        p = _run([exe, "-version"])
+        full = shutil.which(exe)
+        if not full:
+            raise FfmpegError(f"未检测到 {exe}，请先安装并确保在 PATH 中可用。")
+        p = _run([full, "-version"])
         if p.returncode != 0:
             raise FfmpegError(f"未检测到 {exe}，请先安装并确保在 PATH 中可用。\n{p.stderr}")
+        resolved[exe] = full
 
+    _ffmpeg_exes.update(resolved)
+    _ffmpeg_checked = True
 
-def probe_video_meta(path: str) -> VideoMeta:
-    """使用 ffprobe 获取视频元信息（目前只需要时长）。"""
 
-    ensure_ffmpeg_available()
+def _exe(name: str) -> str:
+    """返回 ffmpeg/ffprobe 的绝对路径（未检查过时退回命令名）。"""
+    return _ffmpeg_exes.get(name, name)
+
+
+def _encoder_args(encoder: str, crf: int, preset: str) -> list[str]:
+    """按编码器生成视频编码参数；crf/preset 以 libx264 的语义给出，其他编码器取近似值。"""
+
+    if encoder == "libx264":
+        return ["-c:v", "libx264", "-preset", preset, "-crf", str(crf)]
+    if encoder == "h264_nvenc":
+        return ["-c:v", encoder, "-preset", "p1" if preset == "ultrafast" else "p4", "-cq", str(crf)]
+    if encoder == "h264_qsv":
+        return ["-c:v", encoder, "-global_quality", str(crf)]
+    if encoder == "h264_videotoolbox":
+        # videotoolbox 的 -q:v 为 1-100，越大画质越好
+        return ["-c:v", encoder, "-q:v", str(max(1, min(100, 100 - 2 * crf)))]
+    return ["-c:v", encoder]
+
+
+def _encoder_works(encoder: str) -> bool:
+    """编码器出现在 -encoders 列表中不代表机器上有对应硬件，试编码一帧确认。"""
 
     p = _run(
         [
-            "ffprobe",
+            _exe("ffmpeg"),
+            "-hide_banner",
+            "-f",
+            "lavfi",
+            "-i",
+            "color=c=black:s=256x256:d=0.1",
+            "-frames:v",
+            "1",
+            *_encoder_args(encoder, 23, "veryfast"),
+            "-f",
+            "null",
+            "-",
+        ]
+    )
+    return p.returncode == 0
+
+
+@functools.lru_cache(maxsize=1)
+def _h264_encoder() -> str:
+    """选择 H.264 编码器（进程内只检测一次）。
+
+    优先使用环境变量 QUICLIP_H264_ENCODER，其次是可用的硬件编码器，最后回退 libx264。
+    """
+
+    override = os.environ.get("QUICLIP_H264_ENCODER", "").strip()
+    if override:
+        return override
+
+    ensure_ffmpeg_available()
+
+    p = _capture([_exe("ffmpeg"), "-hide_banner", "-encoders"])
+    if p.returncode != 0:
+        return "libx264"
+    for encoder in _HW_H264_ENCODERS:
+        if encoder in p.stdout and _encoder_works(encoder):
+            return encoder
+    return "libx264"
+
+
+def prepare_h264_encoder() -> str:
+    """提前完成编码器检测并返回所选编码器（结果进程内缓存）。
+
+    检测要跑 ffmpeg -encoders 和若干次试编码，调用方应在持有共享锁之前调用一次。
+    """
+    return _h264_encoder()
+
+
+def max_parallel_encodes() -> int | None:
+    """可同时运行的 H.264 编码进程数上限；libx264 不受限制，返回 None。
+
+    硬件编码器的上限可通过 QUICLIP_HW_ENCODE_PARALLELISM 覆盖。
+    """
+
+    if _h264_encoder() == "libx264":
+        return None
+    raw = os.environ.get("QUICLIP_HW_ENCODE_PARALLELISM", "").strip()
+    try:
+        limit = int(raw) if raw else _HW_ENCODE_PARALLELISM_DEFAULT
+    except ValueError:
+        limit = _HW_ENCODE_PARALLELISM_DEFAULT
+    return max(1, limit)
+
+
+def _h264_args(crf: int, preset: str) -> list[str]:
+    """当前选定 H.264 编码器的视频编码参数。"""
+    return _encoder_args(_h264_encoder(), crf, preset)
+
+
+def fast_input_args(input_path: str) -> list[str]:
+    """输入端快速探测参数（需放在 -i 之前），缩短每次 ffmpeg 启动时的探测耗时。
+
+    ts/mkv/avi 等容器可能要读取较多数据包才能确定流参数，保持默认探测。
+    """
+
+    if os.path.splitext(input_path)[1].lower() not in _FAST_PROBE_EXTS:
+        return []
+    # 注意 -analyzeduration 0 表示“使用默认值（5 秒）”，必须给一个小的正数（单位微秒）
+    return ["-probesize", "32k", "-analyzeduration", "100000", "-fflags", "+fastseek"]
+
+
+def _probe_key(path: str, st: os.stat_result | None) -> tuple[str, int, int]:
+    """各 ffprobe 缓存共用的键 (路径, 大小, 修改时间)；size/mtime_ns 只用于失效判断。"""
+
+    if st is None:
+        try:
+            st = os.stat(path)
+        except OSError as e:
+            raise FfmpegError(f"读取文件信息失败：{e}")
+    return path, st.st_size, st.st_mtime_ns
+
+
+def probe_video_meta(path: str, st: os.stat_result | None = None) -> VideoMeta:
+    """使用 ffprobe 获取视频元信息（目前只需要时长）。
+
+    结果按 (路径, 大小, 修改时间) 缓存，文件变化后自动失效。
+    调用方已有 os.stat 结果时可通过 st 传入，省去一次 stat。
+    """
+
+    return _probe_cached(*_probe_key(path, st))
+
+
+@functools.lru_cache(maxsize=512)
+def _probe_cached(path: str, size: int, mtime_ns: int) -> VideoMeta:
+    """读取容器时长。"""
+
+    ensure_ffmpeg_available()
+
+    p = _capture(
+        [
+            _exe("ffprobe"),
             "-v",
             "error",
             "-show_entries",
             "format=duration",
             "-of",
-            "json",
+            "default=nw=1:nk=1",
             path,
         ]
     )
     if p.returncode != 0:
         raise FfmpegError(f"ffprobe 失败：{p.stderr}")
 
+    # 输出只有时长数字本身（无法获取时为 N/A）
     try:
-        data = json.loads(p.stdout)
-        duration = float(data["format"]["duration"])
+        duration = float(p.stdout.strip())
     except Exception as e:  # noqa: BLE001
         raise FfmpegError(f"解析 ffprobe 输出失败：{e}")
 
     return VideoMeta(duration_seconds=duration)
 
 
+def probe_stream_signature(path: str, st: os.stat_result | None = None) -> tuple[str, ...]:
+    """获取各路流的编码参数签名（编码器、level、extradata 摘要、分辨率、帧率、时间基、采样率等）。
+
+    两个文件签名相同时可直接 -c copy 拼接；缓存方式与 probe_video_meta 相同。
+    """
+
+    return _probe_signature_cached(*_probe_key(path, st))
+
+
+@functools.lru_cache(maxsize=512)
+def _probe_signature_cached(path: str, size: int, mtime_ns: int) -> tuple[str, ...]:
+    """读取各路流的编码参数，每路一行。"""
+
+    ensure_ffmpeg_available()
+
+    p = _capture(
+        [
+            _exe("ffprobe"),
+            "-v",
+            "error",
+            # -c copy 拼接后 mp4 只保留第一个文件的 avcC，SPS/PPS 不同的片段会花屏，
+            # 因此 extradata 摘要必须一致
+            "-show_data_hash",
+            "sha256",
+            "-show_entries",
+            "stream=codec_type,codec_name,profile,level,width,height,pix_fmt,r_frame_rate,time_base,"
+            "sample_rate,channels,extradata_hash",
+            "-of",
+            "csv=p=0",
+            path,
+        ]
+    )
+    if p.returncode != 0:
+        raise FfmpegError(f"ffprobe 失败：{p.stderr}")
+
+    # 每行一路流；只用于相等比较，不需要解析字段
+    return tuple(line.strip() for line in p.stdout.splitlines() if line.strip())
+
+
+def probe_video_format(path: str, st: os.stat_result | None = None) -> VideoFormat:
+    """获取首路视频流的分辨率与帧率；缓存方式与 probe_video_meta 相同。"""
+
+    return _probe_format_cached(*_probe_key(path, st))
+
+
+@functools.lru_cache(maxsize=512)
+def _probe_format_cached(path: str, size: int, mtime_ns: int) -> VideoFormat:
+    """读取首路视频流（不含封面图）的分辨率与平均帧率。"""
+
+    ensure_ffmpeg_available()
+
+    p = _capture(
+        [
+            _exe("ffprobe"),
+            "-v",
+            "error",
+            # V 不含封面图等附加图片流（其帧率通常是 90000/1）
+            "-select_streams",
+            "V:0",
+            # 可变帧率（手机拍摄）的 r_frame_rate 会远高于实际帧率，用平均帧率
+            "-show_entries",
+            "stream=width,height,avg_frame_rate",
+            "-of",
+            "csv=p=0",
+            path,
+        ]
+    )
+    if p.returncode != 0:
+        raise FfmpegError(f"ffprobe 失败：{p.stderr}")
+
+    try:
+        width, height, frame_rate = p.stdout.strip().splitlines()[0].split(",")[:3]
+        return VideoFormat(width=int(width), height=int(height), frame_rate=frame_rate.strip())
+    except Exception as e:  # noqa: BLE001
+        raise FfmpegError(f"解析 ffprobe 输出失败：{e}")
+
+
 def fast_trim_to_mp4(
     input_path: str,
     start_sec: float,
     end_sec: float,
     output_path: str,
+    reencode: bool = False,
+    target: VideoFormat | None = None,
 ) -> None:
-    """无重编码裁剪（mp4 容器），输出用于后续 concat。"""
+    """裁剪为 mp4，输出用于后续 concat。
+
+    - reencode=False（默认）：无重编码（-c copy），速度接近纯 IO，起点按关键帧对齐
+    - reencode=True：H.264 重编码（优先硬件编码器），保证区间时长准确；
+      音频统一为 48kHz 双声道，给出 target 时画面缩放/补边到同一分辨率与帧率，
+      这样不同来源的片段编码参数一致，才能再 -c copy 拼接
+    """
 
     ensure_ffmpeg_available()
 
@@ -83,29 +392,40 @@ def fast_trim_to_mp4(
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
 
     # 说明：
-    # - 无重编码（-c copy）会按关键帧对齐，时间会偏差；这里改为重编码以保证区间时长准确
+    # - 无重编码（-c copy）会按关键帧对齐，时间会有偏差；需要精确区间时使用 reencode=True
     # - -t 使用“持续时间”，避免 -to 在不同位置的语义差异
     # - -ss 放在 -i 前用于快速 seek，速度优先，精度可控制在 1 秒内
     # - -movflags +faststart 便于在线播放
+    if reencode:
+        codec_args = [
+            "-vf",
+            _normalize_filter(target),
+            *_h264_args(18, "veryfast"),
+            "-video_track_timescale",
+            "90000",
+            "-c:a",
+            "aac",
+            "-b:a",
+            "192k",
+            "-ar",
+            "48000",
+            "-ac",
+            "2",
+        ]
+    else:
+        codec_args = ["-c", "copy"]
+
     cmd = [
-        "ffmpeg",
+        _exe("ffmpeg"),
         "-y",
         "-ss",
         f"{start_sec:.3f}",
+        *fast_input_args(input_path),
         "-i",
         input_path,
         "-t",
         f"{duration_sec:.3f}",
-        "-c:v",
-        "libx264",
-        "-preset",
-        "veryfast",
-        "-crf",
-        "18",
-        "-c:a",
-        "aac",
-        "-b:a",
-        "192k",
+        *codec_args,
         "-avoid_negative_ts",
         "make_zero",
         "-movflags",
@@ -118,6 +438,46 @@ def fast_trim_to_mp4(
         raise FfmpegError(f"裁剪失败：{p.stderr}")
 
 
+def _normalize_filter(target: VideoFormat | None) -> str:
+    """重编码时的视频滤镜：按比例缩放并居中补边到目标尺寸，统一帧率、SAR 与像素格式。"""
+
+    filters = []
+    if target is not None:
+        w, h = target.width, target.height
+        filters.append(f"scale={w}:{h}:force_original_aspect_ratio=decrease")
+        filters.append(f"pad={w}:{h}:(ow-iw)/2:(oh-ih)/2")
+        if target.frame_rate and not target.frame_rate.startswith("0"):
+            filters.append(f"fps={target.frame_rate}")
+    filters.append("setsar=1")
+    # 具体编码器需要的格式（如 qsv 的 nv12）由 ffmpeg 自动再转换
+    filters.append("format=yuv420p")
+    return ",".join(filters)
+
+
+def spawn_preview_mp4(input_path: str, start_sec: float, duration_sec: float, output_path: str) -> subprocess.Popen:
+    """启动一个低画质、无音频的预览编码进程并立即返回，便于调用方等待或取消。"""
+
+    ensure_ffmpeg_available()
+
+    cmd = [
+        _exe("ffmpeg"),
+        "-y",
+        "-ss",
+        f"{start_sec:.3f}",
+        *fast_input_args(input_path),
+        "-i",
+        input_path,
+        "-t",
+        f"{duration_sec:.3f}",
+        *_h264_args(28, "ultrafast"),
+        "-an",
+        "-movflags",
+        "+faststart",
+        output_path,
+    ]
+    return subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
 def fast_concat_mp4(inputs: list[str], output_path: str) -> None:
     """无重编码 concat（concat demuxer）。
 
@@ -125,30 +485,70 @@ def fast_concat_mp4(inputs: list[str], output_path: str) -> None:
     - 输入文件必须编码参数一致（常见于同一来源/同一编码设置）
     """
 
-    ensure_ffmpeg_available()
-
     if not inputs:
         raise ValueError("没有输入文件")
 
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    lines = [_concat_file_line(p) for p in inputs]
+
+    _run_concat_list(lines, output_path, "合并失败")
+
+
+def fast_concat_slices_mp4(slices: list[tuple[str, float, float]], output_path: str) -> None:
+    """按 (输入路径, 开始秒, 结束秒) 直接拼接多个片段，一次 ffmpeg、无临时文件。
+
+    利用 concat demuxer 的 inpoint/outpoint 指令在源文件内 seek，
+    与 -c copy 裁剪一样起点按关键帧对齐；各输入编码参数必须一致。
+    """
+
+    if not slices:
+        raise ValueError("没有输入文件")
+
+    lines: list[str] = []
+    for path, start_sec, end_sec in slices:
+        if end_sec <= start_sec:
+            raise ValueError("结束时间必须大于开始时间")
+        lines.append(_concat_file_line(path))
+        lines.append(f"inpoint {float(start_sec):.3f}")
+        lines.append(f"outpoint {float(end_sec):.3f}")
+
+    _run_concat_list(lines, output_path, "剪辑合并失败")
 
-    # concat demuxer 需要一个 list 文件
-    list_file = output_path + ".txt"
-    with open(list_file, "w", encoding="utf-8") as f:
-        for p in inputs:
-            # ffmpeg concat list 对路径有特殊要求
-            escaped = p.replace("'", "\\'")
-            f.write(f"file '{escaped}'\n")
+
+def _concat_file_line(path: str) -> str:
+    """生成 concat list 中的 file 指令。"""
+
+    # concat list 按行解析，路径中不能出现换行
+    if "\n" in path or "\r" in path:
+        raise ValueError(f"路径中包含换行符，无法合并：{path!r}")
+    # list 从 pipe:0 读取时，ffmpeg 会把条目当作相对 pipe: URL 解析（打开 pipe:/abs/path），
+    # 因此必须写成带 file: 协议的绝对路径
+    # ffmpeg 的引号规则：单引号内所有字符（包括反斜杠）都按字面处理，
+    # 单引号本身只能先闭合引号、再用 \' 转义、然后重新打开，即 '\''
+    escaped = os.path.abspath(path).replace("'", "'\\''")
+    return f"file 'file:{escaped}'"
+
+
+def _run_concat_list(lines: list[str], output_path: str, error_label: str) -> None:
+    """通过 stdin 把 concat list 交给 ffmpeg，以 -c copy 执行合并。
+
+    不写 list 文件，省去临时文件的创建与清理；list 按 UTF-8 编码写入 stdin。
+    """
+
+    ensure_ffmpeg_available()
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
 
     cmd = [
-        "ffmpeg",
+        _exe("ffmpeg"),
         "-y",
+        "-protocol_whitelist",
+        "file,pipe",
         "-f",
         "concat",
         "-safe",
         "0",
         "-i",
-        list_file,
+        "pipe:0",
         "-c",
         "copy",
         "-movflags",
@@ -156,11 +556,6 @@ def fast_concat_mp4(inputs: list[str], output_path: str) -> None:
         output_path,
     ]
 
-    p = _run(cmd)
-    try:
-        os.remove(list_file)
-    except OSError:
-        pass
-
+    p = _run(cmd, input="".join(line + "\n" for line in lines))
     if p.returncode != 0:
-        raise FfmpegError(f"合并失败：{p.stderr}")
+        raise FfmpegError(f"{error_label}：{p.stderr}")
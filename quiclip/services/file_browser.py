@@ -6,11 +6,113 @@ from __future__ import annotations
 """
 
 import os
-from dataclasses import dataclass
-from typing import List
+import stat
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Tuple
 
 
-VIDEO_EXTS = {".mp4", ".mov", ".mkv", ".m4v", ".avi", ".ts", ".wmv"}
+VIDEO_EXTS = frozenset({".mp4", ".mov", ".mkv", ".m4v", ".avi", ".ts", ".wmv"})
+
+# 不带点的扩展名，配合 rpartition 判断，省去 splitext
+_VIDEO_EXTS_NODOT = frozenset(e[1:] for e in VIDEO_EXTS)
+
+# 路径校验用的 stat 缓存：UI 一次操作会在很短时间内多次校验同一路径
+_STAT_TTL_SEC = 1.0
+_STAT_CACHE_MAX = 1024
+
+# resolve_video 结果缓存：方向键连续浏览时同一选择会被反复解析
+_RESOLVED_TTL_SEC = 1.0
+_RESOLVED_CACHE_MAX = 128
+
+# 每个 PathGuard 记住的“必然被拒绝”的选择数
+_REJECTED_CACHE_MAX = 256
+
+# 目录列表缓存：以目录 st_mtime_ns 校验，目录项增删改名都会改变 mtime
+_DIR_CACHE_MAX = 512
+_dir_cache: Dict[str, Tuple[int, List[Tuple[str, bool]]]] = {}
+_dir_cache_lock = threading.Lock()
+
+
+class _TtlCache:
+    """线程安全的短 TTL 缓存；满了直接清空，条目数很小，不值得做 LRU。"""
+
+    def __init__(self, ttl_sec: float, max_size: int) -> None:
+        self._ttl_sec = ttl_sec
+        self._max_size = max_size
+        self._data: Dict[str, Tuple[float, Any]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str, now: float) -> Tuple[bool, Any]:
+        """返回 (是否命中, 值)；值本身可能是 None。"""
+        with self._lock:
+            hit = self._data.get(key)
+        if hit is not None and hit[0] > now:
+            return True, hit[1]
+        return False, None
+
+    def put(self, key: str, value: Any, now: float) -> None:
+        with self._lock:
+            if len(self._data) >= self._max_size:
+                self._data.clear()
+            self._data[key] = (now + self._ttl_sec, value)
+
+
+_stat_cache = _TtlCache(_STAT_TTL_SEC, _STAT_CACHE_MAX)
+
+
+def _cached_stat(path: str) -> os.stat_result | None:
+    """带短 TTL 的 os.stat，路径不存在时返回 None。"""
+    now = time.monotonic()
+    found, st = _stat_cache.get(path, now)
+    if found:
+        return st
+
+    try:
+        st = os.stat(path)
+    except OSError:
+        st = None
+    _stat_cache.put(path, st, now)
+    return st
+
+
+def _is_file(path: str) -> bool:
+    st = _cached_stat(path)
+    return st is not None and stat.S_ISREG(st.st_mode)
+
+
+def _is_dir(path: str) -> bool:
+    st = _cached_stat(path)
+    return st is not None and stat.S_ISDIR(st.st_mode)
+
+
+def list_dir_entries(dir_abs: str) -> List[Tuple[str, bool]]:
+    """列出目录项 (名称, 是否目录)，按名称排序；目录不存在时返回空列表。
+
+    目录 mtime 未变时直接复用上次 scandir 的结果，只付出一次 stat。
+    """
+    try:
+        mtime_ns = os.stat(dir_abs).st_mtime_ns
+    except OSError:
+        return []
+    with _dir_cache_lock:
+        hit = _dir_cache.get(dir_abs)
+    if hit is not None and hit[0] == mtime_ns:
+        return hit[1]
+
+    try:
+        with os.scandir(dir_abs) as it:
+            entries = sorted((e.name, e.is_dir()) for e in it)
+    except OSError:
+        return []
+
+    with _dir_cache_lock:
+        if len(_dir_cache) >= _DIR_CACHE_MAX:
+            _dir_cache.clear()
+        _dir_cache[dir_abs] = (mtime_ns, entries)
+    return entries
 
 
 @dataclass(frozen=True)
@@ -21,6 +123,95 @@ class FileItem:
     path: str
 
 
+@dataclass(frozen=True)
+class PathGuard:
+    """把路径限制在媒体根目录内的校验器。
+
+    根目录绝对路径只在构建时计算一次；UI 各事件处理共用同一实例。
+    """
+
+    root_abs: str
+    # 带结尾分隔符的根目录前缀，用于一次比较完成“位于根目录内”的判断
+    _prefix: str = field(init=False, repr=False, compare=False)
+    # 仅由字符串本身决定的拒绝（根目录外、非视频扩展名）结果不会随时间变化，可以长期记住
+    _rejected: "OrderedDict[str, None]" = field(default_factory=OrderedDict, init=False, repr=False, compare=False)
+    _rejected_lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False, compare=False)
+    # 其余结果依赖文件是否存在，只在很短的 TTL 内复用
+    _resolved: _TtlCache = field(
+        default_factory=lambda: _TtlCache(_RESOLVED_TTL_SEC, _RESOLVED_CACHE_MAX),
+        init=False,
+        repr=False,
+        compare=False,
+    )
+
+    def __post_init__(self) -> None:
+        prefix = self.root_abs if self.root_abs.endswith(os.sep) else self.root_abs + os.sep
+        object.__setattr__(self, "_prefix", prefix)
+
+    @staticmethod
+    def for_root(media_root: str) -> "PathGuard":
+        return PathGuard(root_abs=os.path.abspath(media_root))
+
+    def contains(self, full: str) -> bool:
+        """绝对路径 full 是否位于根目录内（前缀带分隔符，/a/b 不会匹配 /a/bb）。"""
+        # 直接比较 str：startswith 本身就是按码位 memcmp，
+        # 先 os.fsencode 反而每次多一次编码和 bytes 分配
+        return full == self.root_abs or full.startswith(self._prefix)
+
+    def relative(self, full: str) -> str:
+        """根目录内绝对路径的相对路径；已规范化的路径直接切掉前缀，其余交给 relpath。"""
+        if full.startswith(self._prefix):
+            return full[len(self._prefix):]
+        return os.path.relpath(full, self.root_abs)
+
+    def resolve_video(self, path_value: str | None) -> str | None:
+        """校验并解析 FileExplorer 选择的视频文件路径，返回绝对路径。"""
+        if not path_value:
+            return None
+        if self._is_rejected(path_value):
+            return None
+        now = time.monotonic()
+        found, resolved = self._resolved.get(path_value, now)
+        if found:
+            return resolved
+        full = os.path.abspath(path_value)
+        # 先做纯字符串的判断，不合法就不必再访问文件系统
+        if not self.contains(full) or not _has_video_ext(full):
+            self._remember_rejected(path_value)
+            return None
+        resolved = full if _is_file(full) else None
+        self._resolved.put(path_value, resolved, now)
+        return resolved
+
+    def _is_rejected(self, path_value: str) -> bool:
+        with self._rejected_lock:
+            if path_value not in self._rejected:
+                return False
+            self._rejected.move_to_end(path_value)
+            return True
+
+    def _remember_rejected(self, path_value: str) -> None:
+        with self._rejected_lock:
+            self._rejected[path_value] = None
+            self._rejected.move_to_end(path_value)
+            if len(self._rejected) > _REJECTED_CACHE_MAX:
+                self._rejected.popitem(last=False)
+
+    def safe_dir(self, path_value: str | None) -> str:
+        """将输出目录限制在根目录内，避免目录穿越；非法时回退到根目录。"""
+        if not path_value:
+            return self.root_abs
+        full = os.path.abspath(path_value)
+        if not self.contains(full):
+            return self.root_abs
+        if _is_dir(full):
+            return full
+        parent = os.path.dirname(full)
+        if _is_dir(parent) and self.contains(parent):
+            return parent
+        return self.root_abs
+
+
 def list_video_files(media_root: str, relative_dir: str = "") -> List[FileItem]:
     """列出 media_root 下（可选子目录）的视频文件。
 
@@ -35,19 +226,23 @@ def list_video_files(media_root: str, relative_dir: str = "") -> List[FileItem]:
         return []
 
     # 防止目录穿越
-    media_root_abs = os.path.abspath(media_root)
+    guard = PathGuard.for_root(media_root)
     base_dir_abs = os.path.abspath(base_dir)
-    if not base_dir_abs.startswith(media_root_abs):
+    if not guard.contains(base_dir_abs):
         return []
 
-    items: List[FileItem] = []
+    # scandir 的 DirEntry 自带目录项类型，绝大多数情况下无需逐个 stat
     try:
-        for name in sorted(os.listdir(base_dir_abs)):
-            path = os.path.join(base_dir_abs, name)
-            if os.path.isfile(path) and os.path.splitext(name)[1].lower() in VIDEO_EXTS:
-                rel_path = os.path.relpath(path, media_root_abs)
-                items.append(FileItem(label=rel_path, path=path))
+        with os.scandir(base_dir_abs) as it:
+            entries = [e for e in it if _has_video_ext(e.name) and e.is_file()]
     except OSError:
         return []
 
-    return items
+    entries.sort(key=lambda e: e.name)
+    return [FileItem(label=guard.relative(e.path), path=e.path) for e in entries]
+
+
+def _has_video_ext(name: str) -> bool:
+    """文件名或路径是否带视频扩展名（与 splitext 判断一致，隐藏文件如 .mp4 不算）。"""
+    stem, dot, ext = name.rpartition(".")
+    return bool(dot and stem) and stem[-1] != os.sep and ext.lower() in _VIDEO_EXTS_NODOT
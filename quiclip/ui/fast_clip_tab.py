@@ -5,23 +5,64 @@ from __future__ import annotations
 在同一视频上选择多个区间，批量裁剪后按顺序合并输出。
 """
 
+import atexit
+import hashlib
+import itertools
 import os
+import shutil
 import subprocess
 import tempfile
-import time
-from typing import Any, Dict, List
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
 
 import gradio as gr
 
-try:
-    from gradio_rangeslider import RangeSlider as ExternalRangeSlider
-except Exception:  # noqa: BLE001
-    ExternalRangeSlider = None
-
 from quiclip.config import AppConfig
 from quiclip.services.clip_merge import ClipSegment, clip_and_merge
-from quiclip.services.file_browser import VIDEO_EXTS
-from quiclip.services.ffmpeg_utils import FfmpegError, probe_video_meta
+from quiclip.services.file_browser import PathGuard
+from quiclip.services.ffmpeg_utils import FfmpegError, prepare_h264_encoder, probe_video_meta, spawn_preview_mp4
+from quiclip.ui.file_explorer import cached_file_explorer
+
+# 预览片段缓存：(路径, mtime_ns, 开始, 结束) -> 预览文件，进程内所有会话共用
+_PREVIEW_CACHE_SIZE = 32
+_preview_cache: "OrderedDict[Tuple[str, int, float, float], str]" = OrderedDict()
+_preview_cache_lock = threading.Lock()
+_preview_dir: str | None = None
+
+
+def _get_preview_dir() -> str:
+    """返回进程内共用的预览目录（首次调用时创建，进程退出时清理）。"""
+    global _preview_dir
+    with _preview_cache_lock:
+        if _preview_dir is None:
+            _preview_dir = tempfile.mkdtemp(prefix="quiclip_preview_")
+            atexit.register(shutil.rmtree, _preview_dir, ignore_errors=True)
+        return _preview_dir
+
+
+def _preview_cache_get(key: Tuple[str, int, float, float]) -> str | None:
+    with _preview_cache_lock:
+        out_path = _preview_cache.get(key)
+        if out_path is None:
+            return None
+        if not os.path.exists(out_path):
+            del _preview_cache[key]
+            return None
+        _preview_cache.move_to_end(key)
+        return out_path
+
+
+def _preview_cache_put(key: Tuple[str, int, float, float], out_path: str) -> None:
+    with _preview_cache_lock:
+        _preview_cache[key] = out_path
+        _preview_cache.move_to_end(key)
+        while len(_preview_cache) > _PREVIEW_CACHE_SIZE:
+            _, evicted = _preview_cache.popitem(last=False)
+            try:
+                os.remove(evicted)
+            except OSError:
+                pass
 
 
 def build_fast_clip_tab(config: AppConfig) -> None:
@@ -30,20 +71,23 @@ def build_fast_clip_tab(config: AppConfig) -> None:
     state_segments = gr.State([])  # List[Dict]
     state_selected = gr.State(None)  # 1-based index
     state_duration = gr.State(0.0)
-    media_root_abs = os.path.abspath(config.media_root)
+    guard = PathGuard.for_root(config.media_root)
+    media_root_abs = guard.root_abs
     max_inline_preview_mb = os.environ.get("QUICLIP_MAX_INLINE_PREVIEW_MB", "50").strip()
     try:
         max_inline_preview_bytes = max(int(max_inline_preview_mb), 0) * 1024 * 1024
     except Exception:  # noqa: BLE001
         max_inline_preview_bytes = 200 * 1024 * 1024
 
-    preview_artifacts: List[str] = []
+    # 预览编码：每个会话同一时间只保留最新一次 ffmpeg 进程，旧的直接终止
+    preview_lock = threading.Lock()
+    preview_procs: Dict[str, subprocess.Popen] = {}
+    # 每个会话最新一次预览请求的编号；编号全局递增，删除条目后也不会与仍在进行的旧请求重号
+    preview_generations: Dict[str, int] = {}
+    preview_counter = itertools.count(1)
 
-    def _get_file_size(path: str) -> int | None:
-        try:
-            return int(os.path.getsize(path))
-        except OSError:
-            return None
+    def _session_key(request: gr.Request | None) -> str:
+        return str(getattr(request, "session_hash", None) or "")
 
     def _format_size(size_bytes: int | None) -> str:
         if size_bytes is None:
@@ -54,55 +98,6 @@ def build_fast_clip_tab(config: AppConfig) -> None:
         gb = mb / 1024
         return f"{gb:.2f} GB"
 
-    def _prune_preview_artifacts(keep_last: int = 40) -> None:
-        nonlocal preview_artifacts
-        if len(preview_artifacts) <= keep_last:
-            return
-        to_delete = preview_artifacts[:-keep_last]
-        preview_artifacts = preview_artifacts[-keep_last:]
-        for p in to_delete:
-            try:
-                os.remove(p)
-            except OSError:
-                pass
-            try:
-                d = os.path.dirname(p)
-                os.rmdir(d)
-            except OSError:
-                pass
-
-    def _resolve_selected_path(path_value: str | None) -> str | None:
-        """校验并解析 FileExplorer 选择的路径，返回绝对路径。"""
-        if not path_value:
-            return None
-        full = os.path.abspath(path_value)
-        if not full.startswith(media_root_abs):
-            return None
-        if not os.path.isfile(full):
-            return None
-        if os.path.splitext(full)[1].lower() not in VIDEO_EXTS:
-            return None
-        return full
-
-    def _safe_dir(path_value: str | None) -> str:
-        """将输出目录限制在媒体根目录内，避免目录穿越。"""
-        if not path_value:
-            return media_root_abs
-        full = os.path.abspath(path_value)
-        if not full.startswith(media_root_abs):
-            return media_root_abs
-        if os.path.isdir(full):
-            return full
-        parent = os.path.dirname(full)
-        if os.path.isdir(parent) and parent.startswith(media_root_abs):
-            return parent
-        return media_root_abs
-
-    def _normalize_selected_file(path_value: str | None) -> str:
-        """将选择结果标准化为 Textbox 可展示的路径字符串。"""
-        resolved = _resolve_selected_path(path_value)
-        return resolved or ""
-
     gr.HTML(
         """
         <style>
@@ -134,7 +129,7 @@ def build_fast_clip_tab(config: AppConfig) -> None:
     )
 
     gr.Markdown("## 1) 选择文件")
-    file_explorer = gr.FileExplorer(
+    file_explorer = cached_file_explorer(
         label="视频文件",
         root_dir=media_root_abs,
         file_count="single",
@@ -191,67 +186,81 @@ def build_fast_clip_tab(config: AppConfig) -> None:
     output_video = gr.Video(label="输出预览")
     status_text = gr.Markdown("")
 
-    def _make_preview_clip(path: str, start_sec: float, end_sec: float) -> str | None:
+    def _make_preview_clip(path: str, start_sec: float, end_sec: float, session_key: str = "") -> str | None:
         try:
-            start = max(float(start_sec), 0.0)
-            end = max(float(end_sec), 0.0)
+            # 取 0.1 秒精度，来回拖动到相同位置时可以命中缓存
+            start = round(max(float(start_sec), 0.0), 1)
+            end = round(max(float(end_sec), 0.0), 1)
             if end <= start:
                 return None
 
+            key = (path, os.stat(path).st_mtime_ns, start, end)
+            cached = _preview_cache_get(key)
+            if cached:
+                return cached
+
             duration = min(end - start, 8.0)
-            out_dir = tempfile.mkdtemp(prefix="quiclip_preview_")
-            ts = time.strftime("%Y%m%d-%H%M%S")
-            out_path = os.path.join(out_dir, f"preview-{ts}.mp4")
-            cmd = [
-                "ffmpeg",
-                "-y",
-                "-ss",
-                f"{start:.3f}",
-                "-i",
-                path,
-                "-t",
-                f"{duration:.3f}",
-                "-c:v",
-                "libx264",
-                "-preset",
-                "veryfast",
-                "-crf",
-                "28",
-                "-an",
-                "-movflags",
-                "+faststart",
-                out_path,
-            ]
-            p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-            if p.returncode != 0:
-                return None
-            preview_artifacts.append(out_path)
-            _prune_preview_artifacts()
+            preview_dir = _get_preview_dir()
+            digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:16]
+            out_path = os.path.join(preview_dir, f"preview-{digest}.mp4")
+            # 先写临时文件再改名，避免多个会话同时生成同一预览时互相覆盖
+            fd, tmp_path = tempfile.mkstemp(prefix=f"preview-{digest}-", suffix=".mp4", dir=preview_dir)
+            os.close(fd)
+            replaced = False
+            try:
+                # 首次编码器检测较慢，放在共享锁之外完成，不阻塞其他会话
+                prepare_h264_encoder()
+                with preview_lock:
+                    prev = preview_procs.get(session_key)
+                    if prev is not None and prev.poll() is None:
+                        prev.terminate()
+                    proc = spawn_preview_mp4(path, start, duration, tmp_path)
+                    preview_procs[session_key] = proc
+                returncode = proc.wait()
+                with preview_lock:
+                    if preview_procs.get(session_key) is proc:
+                        del preview_procs[session_key]
+                if returncode != 0:
+                    # 编码失败或被同一会话的新预览请求取消
+                    return None
+                os.replace(tmp_path, out_path)
+                replaced = True
+            finally:
+                # 启动失败、编码失败或被取消时都不在共享预览目录里留下空文件
+                if not replaced:
+                    try:
+                        os.remove(tmp_path)
+                    except OSError:
+                        pass
+            _preview_cache_put(key, out_path)
             return out_path
         except Exception:  # noqa: BLE001
             return None
 
-    def _pick_video_preview(path: str, duration_seconds: float) -> tuple[str | None, str]:
-        size_bytes = _get_file_size(path)
+    def _pick_video_preview(
+        path: str, duration_seconds: float, size_bytes: int | None, session_key: str = ""
+    ) -> tuple[str | None, str]:
         if size_bytes is not None and size_bytes <= max_inline_preview_bytes:
             return path, "原视频"
         end = min(max(float(duration_seconds), 0.0), 5.0)
-        preview = _make_preview_clip(path, 0.0, end)
+        preview = _make_preview_clip(path, 0.0, end, session_key)
         return preview, "前 5 秒预览"
 
-    def _load_video_for_range(path_value: str | None, out_dir_value: str | None):
-        path = _resolve_selected_path(path_value)
+    def _load_video_for_range(path_value: str | None, out_dir_value: str | None, request: gr.Request):
+        path = guard.resolve_video(path_value)
         if not path:
-            return None, "**提示**：请选择有效的视频文件。", gr.update(), gr.update(), gr.update(), gr.update(), gr.update(), _safe_dir(out_dir_value)
+            return None, "**提示**：请选择有效的视频文件。", gr.update(), gr.update(), gr.update(), gr.update(), gr.update(), guard.safe_dir(out_dir_value)
 
+        # 一次 stat 同时用于时长缓存校验、大小展示和预览方式选择
         try:
-            meta = probe_video_meta(path)
+            st = os.stat(path)
+            meta = probe_video_meta(path, st)
         except Exception as e:  # noqa: BLE001
-            return None, f"**错误**：读取视频信息失败：{e}", gr.update(), gr.update(), gr.update(), gr.update(), gr.update(), _safe_dir(out_dir_value)
+            return None, f"**错误**：读取视频信息失败：{e}", gr.update(), gr.update(), gr.update(), gr.update(), gr.update(), guard.safe_dir(out_dir_value)
 
-        rel_label = os.path.relpath(path, media_root_abs)
-        size_bytes = _get_file_size(path)
-        video_value, preview_mode = _pick_video_preview(path, meta.duration_seconds)
+        rel_label = guard.relative(path)
+        size_bytes = st.st_size
+        video_value, preview_mode = _pick_video_preview(path, meta.duration_seconds, size_bytes, _session_key(request))
         md = (
             f"**文件**：`{rel_label}`  \n"
             f"**大小**：{_format_size(size_bytes)}  \n"
@@ -269,7 +278,7 @@ def build_fast_clip_tab(config: AppConfig) -> None:
             gr.update(value=None),
             gr.update(value=None),
             add_update,
-            _safe_dir(os.path.dirname(path)),
+            guard.safe_dir(os.path.dirname(path)),
         )
 
     def _format_current_time(t: float | None) -> str:
@@ -279,10 +288,14 @@ def build_fast_clip_tab(config: AppConfig) -> None:
             v = 0.0
         return f"当前时间（秒）：{v:.2f}"
 
-    def _preview_from_time(path_value: str | None, t: float, duration_seconds: float):
-        path = _resolve_selected_path(path_value)
+    def _preview_from_time(path_value: str | None, t: float, duration_seconds: float, request: gr.Request):
+        path = guard.resolve_video(path_value)
         if not path:
             return gr.update()
+        key = _session_key(request)
+        with preview_lock:
+            generation = next(preview_counter)
+            preview_generations[key] = generation
         try:
             tt = max(float(t), 0.0)
         except Exception:  # noqa: BLE001
@@ -294,8 +307,17 @@ def build_fast_clip_tab(config: AppConfig) -> None:
         end = tt + 3.0
         if dur > 0:
             end = min(end, dur)
-        preview = _make_preview_clip(path, tt, end)
-        return preview
+        try:
+            preview = _make_preview_clip(path, tt, end, key)
+        finally:
+            with preview_lock:
+                latest = preview_generations.get(key) == generation
+                if latest:
+                    del preview_generations[key]
+        # 已有更新的请求（例如命中缓存先返回）时丢弃本次结果，避免旧预览覆盖新预览
+        if not latest:
+            return gr.update()
+        return preview if preview else gr.update()
 
     def _can_add(start_sec: float | None, end_sec: float | None, duration_seconds: float) -> bool:
         try:
@@ -347,45 +369,16 @@ def build_fast_clip_tab(config: AppConfig) -> None:
             return gr.update()
         return gr.update(value=ct)
 
-    def _load_video_for_sliders(path_value: str | None, out_dir_value: str | None):
-        path = _resolve_selected_path(path_value)
+    def _on_file_selected(path_value: str | None) -> tuple[str, str]:
+        """选择文件后一次性返回（完整路径, 默认输出目录），只解析一次路径。"""
+        path = guard.resolve_video(path_value)
         if not path:
-            return None, "**提示**：请选择有效的视频文件。", gr.update(), gr.update(), _safe_dir(out_dir_value)
-
-        try:
-            meta = probe_video_meta(path)
-        except Exception as e:  # noqa: BLE001
-            return None, f"**错误**：读取视频信息失败：{e}", gr.update(), gr.update(), _safe_dir(out_dir_value)
-
-        rel_label = os.path.relpath(path, media_root_abs)
-        size_bytes = _get_file_size(path)
-        video_value, preview_mode = _pick_video_preview(path, meta.duration_seconds)
-        md = (
-            f"**文件**：`{rel_label}`  \n"
-            f"**大小**：{_format_size(size_bytes)}  \n"
-            f"**时长**：{meta.duration_seconds:.3f} 秒  \n"
-            f"**预览**：{preview_mode}"
-        )
-        max_v = max(meta.duration_seconds, 0.1)
-        start_update = gr.update(minimum=0, maximum=max_v, value=0)
-        end_update = gr.update(minimum=0, maximum=max_v, value=min(meta.duration_seconds, 5.0))
-        return video_value, md, start_update, end_update, _safe_dir(os.path.dirname(path))
-
-    def _default_out_dir_from_file(path_value: str | None) -> str:
-        path = _resolve_selected_path(path_value)
-        if not path:
-            return media_root_abs
-        return _safe_dir(os.path.dirname(path))
+            return "", media_root_abs
+        return path, guard.safe_dir(os.path.dirname(path))
 
     def _segments_to_rows(segments: List[Dict[str, Any]]):
-        rows: List[List[Any]] = []
-        for i, s in enumerate(segments, start=1):
-            try:
-                rel_label = os.path.relpath(str(s["path"]), media_root_abs)
-            except Exception:  # noqa: BLE001
-                rel_label = str(s.get("label") or s.get("path") or "")
-            rows.append([i, rel_label, float(s["start_sec"]), float(s["end_sec"])])
-        return rows
+        # rel 在添加时已算好，重绘只需重新编号
+        return [[i, s["rel"], s["start_sec"], s["end_sec"]] for i, s in enumerate(segments, start=1)]
 
     def _add_segment(
         path_value: str | None,
@@ -394,41 +387,51 @@ def build_fast_clip_tab(config: AppConfig) -> None:
         segments: List[Dict[str, Any]],
         selected: int | None,
     ):
-        path = _resolve_selected_path(path_value)
+        path = guard.resolve_video(path_value)
         if not path:
-            return segments, _segments_to_rows(segments), selected
+            return segments, gr.update(), selected
 
         try:
             if start_sec is None or end_sec is None:
-                return segments, _segments_to_rows(segments), selected
+                return segments, gr.update(), selected
             start, end = float(start_sec), float(end_sec)
         except Exception:  # noqa: BLE001
-            return segments, _segments_to_rows(segments), selected
+            return segments, gr.update(), selected
         if end <= start:
-            return segments, _segments_to_rows(segments), selected
+            return segments, gr.update(), selected
         segments = list(segments)
-        segments.append({"label": os.path.basename(path), "path": path, "start_sec": start, "end_sec": end})
+        segments.append(
+            {
+                "label": os.path.basename(path),
+                "path": path,
+                "rel": guard.relative(path),
+                "start_sec": start,
+                "end_sec": end,
+            }
+        )
         new_selected = len(segments)
         return segments, _segments_to_rows(segments), new_selected
 
+    # 以下处理在列表未变化时对表格返回 gr.update()，不再重新下发整张表
     def _move(segments: List[Dict[str, Any]], selected: int | None, direction: int):
-        segments = list(segments)
         if selected is None:
-            return segments, _segments_to_rows(segments), None
+            return segments, gr.update(), None
         i = int(selected) - 1
         j = i + direction
         if i < 0 or i >= len(segments) or j < 0 or j >= len(segments):
-            return segments, _segments_to_rows(segments), selected
+            return segments, gr.update(), selected
+        # 只在确实需要修改时才复制列表
+        segments = list(segments)
         segments[i], segments[j] = segments[j], segments[i]
         return segments, _segments_to_rows(segments), j + 1
 
     def _delete(segments: List[Dict[str, Any]], selected: int | None):
-        segments = list(segments)
         if selected is None:
-            return segments, _segments_to_rows(segments), None
+            return segments, gr.update(), None
         i = int(selected) - 1
         if i < 0 or i >= len(segments):
-            return segments, _segments_to_rows(segments), selected
+            return segments, gr.update(), selected
+        segments = list(segments)
         segments.pop(i)
         if not segments:
             new_selected = None
@@ -436,25 +439,27 @@ def build_fast_clip_tab(config: AppConfig) -> None:
             new_selected = min(i + 1, len(segments))
         return segments, _segments_to_rows(segments), new_selected
 
-    def _clear():
+    def _clear(segments: List[Dict[str, Any]]):
+        # 已经是空列表时不产生任何更新，重复点击不会触发前端重绘
+        if not segments:
+            return gr.update(), gr.update(), gr.update()
         return [], [], None
 
     def _run(segments: List[Dict[str, Any]], out_dir_value: str | None):
         try:
-            out_dir = _safe_dir(out_dir_value)
+            out_dir = guard.safe_dir(out_dir_value)
             segs = [
                 ClipSegment(input_path=s["path"], start_sec=float(s["start_sec"]), end_sec=float(s["end_sec"]))
                 for s in segments
             ]
             out_path = clip_and_merge(segs, out_dir)
-            return out_path, f"**完成**：`{os.path.relpath(out_path, media_root_abs)}`"
+            return out_path, f"**完成**：`{guard.relative(out_path)}`"
         except (FfmpegError, ValueError) as e:
             return None, f"**错误**：{e}"
         except Exception as e:  # noqa: BLE001
             return None, f"**未知错误**：{e}"
 
-    file_explorer.change(_normalize_selected_file, inputs=[file_explorer], outputs=[selected_file_path])
-    file_explorer.change(_default_out_dir_from_file, inputs=[file_explorer], outputs=[selected_output_dir])
+    file_explorer.change(_on_file_selected, inputs=[file_explorer], outputs=[selected_file_path, selected_output_dir])
 
     load_btn.click(
         _load_video_for_range,
@@ -462,10 +467,14 @@ def build_fast_clip_tab(config: AppConfig) -> None:
         outputs=[video_preview, meta_text, current_time_slider, state_duration, start_input, end_input, add_btn, selected_output_dir],
     )
 
-    current_time_slider.change(
+    # 松开滑块时才生成预览，拖动过程中不产生请求；
+    # trigger_mode="multiple"：新的请求能及时到达后端，从而取消进行中的旧预览
+    current_time_slider.release(
         _preview_from_time,
         inputs=[selected_file_path, current_time_slider, state_duration],
         outputs=[video_preview],
+        trigger_mode="multiple",
+        concurrency_limit=None,
     )
 
     set_start_btn.click(
@@ -502,11 +511,12 @@ def build_fast_clip_tab(config: AppConfig) -> None:
         except Exception:  # noqa: BLE001
             return 1
 
-    segments_df.select(_select_row, inputs=None, outputs=[state_selected])
+    # 选中行只更新一个序号：不进队列、不显示加载遮罩，减少点击延迟
+    segments_df.select(_select_row, inputs=None, outputs=[state_selected], queue=False, show_progress="hidden")
 
     up_btn.click(lambda segs, sel: _move(segs, sel, -1), inputs=[state_segments, state_selected], outputs=[state_segments, segments_df, state_selected])
     down_btn.click(lambda segs, sel: _move(segs, sel, 1), inputs=[state_segments, state_selected], outputs=[state_segments, segments_df, state_selected])
     del_btn.click(_delete, inputs=[state_segments, state_selected], outputs=[state_segments, segments_df, state_selected])
-    clear_btn.click(_clear, outputs=[state_segments, segments_df, state_selected])
+    clear_btn.click(_clear, inputs=[state_segments], outputs=[state_segments, segments_df, state_selected])
 
     run_btn.click(_run, inputs=[state_segments, selected_output_dir], outputs=[output_video, status_text])
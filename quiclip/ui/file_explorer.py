@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+"""带目录列表缓存的 FileExplorer。
+
+前端每展开一层目录都会调用一次 ls；媒体目录在网络盘上时，
+listdir + 逐项 isdir 是主要耗时，这里改为走 file_browser 的目录缓存。
+"""
+
+import fnmatch
+import os
+from typing import Any
+
+import gradio as gr
+from gradio.components.base import server
+
+from quiclip.services.file_browser import list_dir_entries
+
+
+def cached_file_explorer(**kwargs: Any) -> gr.FileExplorer:
+    """创建 gr.FileExplorer，并把该实例的 ls 换成使用缓存目录列表的版本。
+
+    不定义子类：Gradio 组件的子类在定义时会由 ComponentMeta 往源码目录生成 .pyi，
+    目录不可写时甚至会导致导入失败。component_server 按实例属性查找 ls，实例上覆盖即可生效。
+    """
+
+    explorer = gr.FileExplorer(**kwargs)
+
+    @server
+    def ls(subdirectory: list[str] | None = None) -> list[dict[str, str]] | None:
+        return _ls_cached(explorer, subdirectory)
+
+    explorer.ls = ls  # type: ignore[method-assign]
+    return explorer
+
+
+def _ls_cached(explorer: gr.FileExplorer, subdirectory: list[str] | None) -> list[dict[str, str]]:
+    """与 gr.FileExplorer.ls 结果一致（glob / ignore_glob / valid 语义相同）。"""
+
+    full_subdir_path = explorer._safe_join(subdirectory or [])
+
+    files, folders = [], []
+    for item, is_dir in list_dir_entries(full_subdir_path):
+        full_path = os.path.join(full_subdir_path, item)
+        valid_by_glob = fnmatch.fnmatch(full_path, explorer.glob)
+        if not is_dir and not valid_by_glob:
+            continue
+        if explorer.ignore_glob and fnmatch.fnmatch(full_path, explorer.ignore_glob):
+            continue
+        target = folders if is_dir else files
+        target.append(
+            {
+                "name": item,
+                "type": "folder" if is_dir else "file",
+                "valid": valid_by_glob,
+            }
+        )
+
+    return folders + files
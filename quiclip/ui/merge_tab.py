@@ -5,68 +5,131 @@ from __future__ import annotations
 选择服务器端视频文件并按顺序 concat 合并。
 """
 
+import asyncio
 import os
-from typing import Any, Dict, List
+from functools import partial
+from typing import List, Set
 
 import gradio as gr
 
 from quiclip.config import AppConfig
 from quiclip.services.clip_merge import merge_videos
-from quiclip.services.file_browser import VIDEO_EXTS
+from quiclip.services.file_browser import FileItem, PathGuard
 from quiclip.services.ffmpeg_utils import FfmpegError
+from quiclip.ui.file_explorer import cached_file_explorer
+
+
+def _videos_to_rows(videos: List[FileItem]):
+    """将内部 videos 状态转换为 Dataframe 行（label 即相对路径，添加时已算好）。
+
+    保持 list-of-lists：gr.Dataframe 对列表直接透传，
+    pandas.DataFrame 反而要先经过 to_dict(orient="split") 再转回列表。
+    """
+    return [[i, v.label] for i, v in enumerate(videos, start=1)]
+
+
+def _on_file_selected(path_value: str | None, guard: PathGuard) -> tuple[str, str]:
+    """选择文件后一次性返回（完整路径, 默认输出目录），只解析一次路径。"""
+    path = guard.resolve_video(path_value)
+    if not path:
+        return "", guard.root_abs
+    return path, guard.safe_dir(os.path.dirname(path))
+
+
+def _add(path_value: str | None, videos: List[FileItem], paths: Set[str], guard: PathGuard):
+    path = guard.resolve_video(path_value)
+    if not path:
+        return videos, paths, gr.update(), guard.root_abs, None
+
+    out_dir = guard.safe_dir(os.path.dirname(path))
+    if path in paths:
+        # 已在列表中：表格不变，不重新下发
+        return videos, paths, gr.update(), out_dir, len(videos)
+    videos = list(videos)
+    videos.append(FileItem(label=guard.relative(path), path=path))
+    paths = paths | {path}
+    return videos, paths, _videos_to_rows(videos), out_dir, len(videos)
+
+
+def _move(videos: List[FileItem], selected: int | None, direction: int):
+    # 列表未变化的分支对表格返回 gr.update()，不再重新下发整张表
+    if selected is None:
+        return videos, gr.update(), None
+    i = int(selected) - 1
+    j = i + direction
+    if i < 0 or i >= len(videos) or j < 0 or j >= len(videos):
+        return videos, gr.update(), selected
+    # 只在确实需要修改时才复制列表
+    videos = list(videos)
+    videos[i], videos[j] = videos[j], videos[i]
+    return videos, _videos_to_rows(videos), j + 1
+
+
+def _delete(videos: List[FileItem], paths: Set[str], selected: int | None):
+    if selected is None:
+        return videos, paths, gr.update(), None
+    i = int(selected) - 1
+    if i < 0 or i >= len(videos):
+        return videos, paths, gr.update(), selected
+    videos = list(videos)
+    removed = videos.pop(i)
+    paths = paths - {removed.path}
+    if not videos:
+        new_selected = None
+    else:
+        new_selected = min(i + 1, len(videos))
+    return videos, paths, _videos_to_rows(videos), new_selected
+
+
+def _clear(videos: List[FileItem]):
+    # 已经是空列表时不产生任何更新，重复点击不会触发前端重绘
+    if not videos:
+        return gr.update(), gr.update(), gr.update(), gr.update()
+    return [], set(), [], None
+
+
+async def _run(
+    videos: List[FileItem],
+    out_dir_value: str | None,
+    progress: gr.Progress = gr.Progress(),
+    *,
+    guard: PathGuard,
+):
+    """执行合并并返回（输出视频路径, 状态文案）。
+
+    ffmpeg 在线程中等待，事件循环不被占用；progress 必须保持位置参数，Gradio 才会注入。
+    """
+    try:
+        paths = [v.path for v in videos]
+        out_dir = guard.safe_dir(out_dir_value)
+        progress(0, desc=f"合并 {len(paths)} 个视频…")
+        out_path = await asyncio.to_thread(merge_videos, paths, out_dir)
+        return out_path, f"**完成**：`{guard.relative(out_path)}`"
+    except (FfmpegError, ValueError) as e:
+        return None, f"**错误**：{e}"
+    except Exception as e:  # noqa: BLE001
+        return None, f"**未知错误**：{e}"
+
+
+def _select_row(evt: gr.SelectData):
+    # 不能用 partial 包装：Gradio 依据类型注解注入 SelectData
+    try:
+        return int(evt.index[0]) + 1
+    except Exception:  # noqa: BLE001
+        return 1
 
 
 def build_merge_tab(config: AppConfig) -> None:
     """构建“视频合并”Tab。"""
 
-    state_videos = gr.State([])  # List[Dict]
+    state_videos = gr.State([])  # List[FileItem]
+    state_paths = gr.State(set())  # Set[str]，与 state_videos 同步，用于 O(1) 去重
     state_selected = gr.State(None)  # 1-based index
-    media_root_abs = os.path.abspath(config.media_root)
-
-    def _resolve_selected_path(path_value: str | None) -> str | None:
-        """校验并解析 FileExplorer 选择的路径，返回绝对路径。"""
-        if not path_value:
-            return None
-        full = os.path.abspath(path_value)
-        if not full.startswith(media_root_abs):
-            return None
-        if not os.path.isfile(full):
-            return None
-        if os.path.splitext(full)[1].lower() not in VIDEO_EXTS:
-            return None
-        return full
-
-    def _safe_dir(path_value: str | None) -> str:
-        """将输出目录限制在媒体根目录内，避免目录穿越。"""
-        if not path_value:
-            return media_root_abs
-        full = os.path.abspath(path_value)
-        if not full.startswith(media_root_abs):
-            return media_root_abs
-        if os.path.isdir(full):
-            return full
-        parent = os.path.dirname(full)
-        if os.path.isdir(parent) and parent.startswith(media_root_abs):
-            return parent
-        return media_root_abs
-
-    def _normalize_selected_file(path_value: str | None) -> str:
-        resolved = _resolve_selected_path(path_value)
-        return resolved or ""
-
-    def _videos_to_rows(videos: List[Dict[str, Any]]):
-        """将内部 videos 状态转换为 Dataframe 行。"""
-        rows: List[List[Any]] = []
-        for i, v in enumerate(videos, start=1):
-            try:
-                rel_label = os.path.relpath(str(v["path"]), media_root_abs)
-            except Exception:  # noqa: BLE001
-                rel_label = str(v.get("label") or v.get("path") or "")
-            rows.append([i, rel_label])
-        return rows
+    guard = PathGuard.for_root(config.media_root)
+    media_root_abs = guard.root_abs
 
     gr.Markdown("## 1) 选择文件")
-    file_explorer = gr.FileExplorer(
+    file_explorer = cached_file_explorer(
         label="视频文件",
         root_dir=media_root_abs,
         file_count="single",
@@ -103,82 +166,26 @@ def build_merge_tab(config: AppConfig) -> None:
     output_video = gr.Video(label="输出预览")
     status_text = gr.Markdown("")
 
-    def _default_out_dir_from_file(path_value: str | None) -> str:
-        path = _resolve_selected_path(path_value)
-        if not path:
-            return media_root_abs
-        return _safe_dir(os.path.dirname(path))
-
-    def _add(path_value: str | None, videos: List[Dict[str, Any]]):
-        path = _resolve_selected_path(path_value)
-        if not path:
-            return videos, _videos_to_rows(videos), media_root_abs, None
-
-        videos = list(videos)
-        if not any(v.get("path") == path for v in videos):
-            videos.append({"label": os.path.basename(path), "path": path})
-        return videos, _videos_to_rows(videos), _safe_dir(os.path.dirname(path)), len(videos)
-
-    def _move(videos: List[Dict[str, Any]], selected: int | None, direction: int):
-        videos = list(videos)
-        if selected is None:
-            return videos, _videos_to_rows(videos), None
-        i = int(selected) - 1
-        j = i + direction
-        if i < 0 or i >= len(videos) or j < 0 or j >= len(videos):
-            return videos, _videos_to_rows(videos), selected
-        videos[i], videos[j] = videos[j], videos[i]
-        return videos, _videos_to_rows(videos), j + 1
-
-    def _delete(videos: List[Dict[str, Any]], selected: int | None):
-        videos = list(videos)
-        if selected is None:
-            return videos, _videos_to_rows(videos), None
-        i = int(selected) - 1
-        if i < 0 or i >= len(videos):
-            return videos, _videos_to_rows(videos), selected
-        videos.pop(i)
-        if not videos:
-            new_selected = None
-        else:
-            new_selected = min(i + 1, len(videos))
-        return videos, _videos_to_rows(videos), new_selected
-
-    def _clear():
-        return [], [], None
-
-    def _run(videos: List[Dict[str, Any]], out_dir_value: str | None):
-        """执行合并并返回（输出视频路径, 状态文案）。"""
-        try:
-            paths = [v["path"] for v in videos]
-            out_dir = _safe_dir(out_dir_value)
-            out_path = merge_videos(paths, out_dir)
-            return out_path, f"**完成**：`{os.path.relpath(out_path, media_root_abs)}`"
-        except (FfmpegError, ValueError) as e:
-            return None, f"**错误**：{e}"
-        except Exception as e:  # noqa: BLE001
-            return None, f"**未知错误**：{e}"
-
-    file_explorer.change(_normalize_selected_file, inputs=[file_explorer], outputs=[selected_file_path])
-    file_explorer.change(_default_out_dir_from_file, inputs=[file_explorer], outputs=[output_dir])
+    file_explorer.change(partial(_on_file_selected, guard=guard), inputs=[file_explorer], outputs=[selected_file_path, output_dir])
 
     add_btn.click(
-        _add,
-        inputs=[selected_file_path, state_videos],
-        outputs=[state_videos, videos_df, output_dir, state_selected],
+        partial(_add, guard=guard),
+        inputs=[selected_file_path, state_videos, state_paths],
+        outputs=[state_videos, state_paths, videos_df, output_dir, state_selected],
     )
 
-    def _select_row(evt: gr.SelectData):
-        try:
-            return int(evt.index[0]) + 1
-        except Exception:  # noqa: BLE001
-            return 1
-
-    videos_df.select(_select_row, inputs=None, outputs=[state_selected])
-
-    up_btn.click(lambda vids, sel: _move(vids, sel, -1), inputs=[state_videos, state_selected], outputs=[state_videos, videos_df, state_selected])
-    down_btn.click(lambda vids, sel: _move(vids, sel, 1), inputs=[state_videos, state_selected], outputs=[state_videos, videos_df, state_selected])
-    del_btn.click(_delete, inputs=[state_videos, state_selected], outputs=[state_videos, videos_df, state_selected])
-    clear_btn.click(_clear, outputs=[state_videos, videos_df, state_selected])
-
-    run_btn.click(_run, inputs=[state_videos, output_dir], outputs=[output_video, status_text])
\ No newline at end of file
+    # 选中行只更新一个序号：不进队列、不显示加载遮罩，减少点击延迟
+    videos_df.select(_select_row, inputs=None, outputs=[state_selected], queue=False, show_progress="hidden")
+
+    up_btn.click(partial(_move, direction=-1), inputs=[state_videos, state_selected], outputs=[state_videos, videos_df, state_selected])
+    down_btn.click(partial(_move, direction=1), inputs=[state_videos, state_selected], outputs=[state_videos, videos_df, state_selected])
+    del_btn.click(_delete, inputs=[state_videos, state_paths, state_selected], outputs=[state_videos, state_paths, videos_df, state_selected])
+    clear_btn.click(_clear, inputs=[state_videos], outputs=[state_videos, state_paths, videos_df, state_selected])
+
+    # 合并以 -c copy 为主、基本是 I/O 密集，允许两个合并同时进行
+    run_btn.click(
+        partial(_run, guard=guard),
+        inputs=[state_videos, output_dir],
+        outputs=[output_video, status_text],
+        concurrency_limit=2,
+    )
\ No newline at end of file